@@ -3,20 +3,24 @@
 
 import base64
 import datetime
+import fnmatch
 import hashlib
 import hmac
 import itertools
 import json
 import logging
+import mmap
 import os
 import pytz
 import random
 import requests
 import requests.auth
 import requests.exceptions
+import struct
 import sys
 import urllib
 import urlparse
+import zlib
 from collections import Mapping, Iterable
 
 # Set to True to fetch Global Variables for each server.
@@ -32,6 +36,36 @@ IP_VARIABLE = 'publicIp'
 # generally not show up in the inventory even if you add 'suspended' in there
 SERVER_STATUS = ['running', 'pending_terminate']
 
+# Inventory filters, read from comma-separated environment variables.
+# Filtered-out environments, farms and farm roles are dropped as early as
+# possible so that their dependents are never fetched.
+#   SCALR_FILTER_ENVS: environment IDs or names (whole account only)
+#   SCALR_FILTER_FARMS: farm name patterns (shell-style, e.g. 'prod-*')
+#   SCALR_FILTER_FARM_ROLES: farm role aliases
+#   SCALR_FILTER_PLATFORMS: farm role cloudPlatform values (e.g. 'ec2')
+#   SCALR_FILTER_LOCATIONS: server cloudLocation values (e.g. 'us-east-1')
+FILTER_VARIABLES = {
+    'envs': 'SCALR_FILTER_ENVS',
+    'farms': 'SCALR_FILTER_FARMS',
+    'farmRoles': 'SCALR_FILTER_FARM_ROLES',
+    'platforms': 'SCALR_FILTER_PLATFORMS',
+    'locations': 'SCALR_FILTER_LOCATIONS',
+}
+
+# Inventory snapshots. Set SCALR_SNAPSHOT_EXPORT to a path to save the crawled
+# account model there (whole account only), and SCALR_SNAPSHOT to a path to
+# build the inventory from a saved snapshot instead of the Scalr API.
+# Layout: header, a table of hosts sorted by IP (fixed-width entries pointing
+# at the block of their farm), a zlib-compressed JSON index of environments
+# and farms, then one zlib-compressed JSON block per farm. The file is
+# memory-mapped: host lookups binary-search the table in place, and only the
+# farm blocks needed by a query are decompressed.
+SNAPSHOT_MAGIC = 'SCALRSNP'
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = '>8sHII'
+SNAPSHOT_HOST_LENGTH = 64
+SNAPSHOT_HOST = '>{0}sII'.format(SNAPSHOT_HOST_LENGTH)
+
 
 class ScalrApiClient(object):
     def __init__(self, api_url, key_id, key_secret):
@@ -152,86 +186,84 @@ def base_variables(server):
         'SCALR_AGENT_REACHABILITY_STATUS': server['scalrAgent']['reachabilityStatus']['status'],
     }
 
-def get_env_servers(client, envId):
+def get_filters():
+    filters = {}
+    for name, variable in FILTER_VARIABLES.items():
+        values = [v.strip() for v in os.environ.get(variable, '').split(',') if v.strip()]
+        if values:
+            filters[name] = values
+    return filters
+
+def env_selected(filters, env):
+    if 'envs' not in filters:
+        return True
+    return str(env['id']) in filters['envs'] or env['name'] in filters['envs']
+
+def farm_selected(filters, farm):
+    if 'farms' not in filters:
+        return True
+    return any(fnmatch.fnmatchcase(farm['name'], p) for p in filters['farms'])
+
+def farm_role_selected(filters, farmRole):
+    if 'farmRoles' in filters and farmRole['alias'] not in filters['farmRoles']:
+        return False
+    if 'platforms' in filters and farmRole['cloudPlatform'] not in filters['platforms']:
+        return False
+    return True
+
+def server_selected(filters, server):
+    if 'locations' in filters and server['cloudLocation'] not in filters['locations']:
+        return False
+    return True
+
+def list_servers(client, servers_path):
     if '' in SERVER_STATUS:
-        servers_path = '/api/v1beta0/user/{envId}/servers/'.format(envId=envId)
-        servers = client.list(servers_path)
+        return client.list(servers_path)
+    return list(itertools.chain.from_iterable([
+        client.list(servers_path + '?status={s}'.format(s=s))
+        for s in SERVER_STATUS
+    ]))
+
+def get_farms(client, envId, filters, farmId=None):
+    """
+    Crawl the servers of an environment (or of a single farm) and return
+    them as farm records, farm role records nested in them, and server
+    records nested in those.
+    """
+    farmRoles_path = '/api/v1beta0/user/{envId}/farms/{farmId}/farm-roles/'
+    farmServers_path = '/api/v1beta0/user/{envId}/farms/{farmId}/servers/'
+
+    if farmId:
+        farm_path = '/api/v1beta0/user/{envId}/farms/{farmId}/'.format(envId=envId, farmId=farmId)
+        allFarms = [client.fetch(farm_path)]
     else:
-        servers = list(itertools.chain.from_iterable([
-            client.list('/api/v1beta0/user/{envId}/servers/?status={s}'.format(envId=envId, s=s))
-            for s in SERVER_STATUS
-        ]))
-
-    global_variables = {}
-    if FETCH_GV:
-        for server in servers:
-            sId = server['id']
-            GV_path = '/api/v1beta0/user/{envId}/servers/{serverId}/global-variables/'.format(envId=envId, serverId=sId)
-            global_variables[sId] = client.list(GV_path)
-
-    farmIds = []
-    farmRoleIds = []
-    for s in servers:
-        farmIds.append(s['farm']['id'])
-        farmRoleIds.append(s['farmRole']['id'])
-    farmIds = set(farmIds)
-    farmRoleIds = set(farmRoleIds)
+        farms_path = '/api/v1beta0/user/{envId}/farms/'.format(envId=envId)
+        allFarms = client.list(farms_path)
+    farms = {f['id']: f for f in allFarms if farm_selected(filters, f)}
+
+    if farmId or len(farms) < len(allFarms):
+        # Only crawl the servers of the selected farms
+        servers = []
+        for fId in farms:
+            servers.extend(list_servers(client, farmServers_path.format(envId=envId, farmId=fId)))
+    else:
+        servers_path = '/api/v1beta0/user/{envId}/servers/'.format(envId=envId)
+        servers = list_servers(client, servers_path)
 
-    farms = {}
-    farm_path = '/api/v1beta0/user/{envId}/farms/{farmId}/'
-    for farmId in farmIds:
-        path = farm_path.format(envId=envId, farmId=farmId)
-        farms[farmId] = client.fetch(path)
+    # Servers without an IP can't be registered in Ansible
+    servers = [s for s in servers
+               if len(s[IP_VARIABLE]) > 0
+               and s['farm']['id'] in farms
+               and server_selected(filters, s)]
+    started_farms = set([s['farm']['id'] for s in servers])
 
     farmRoles = {}
-    farmRole_path = '/api/v1beta0/user/{envId}/farm-roles/{farmRoleId}/'
-    for farmRoleId in farmRoleIds:
-        path = farmRole_path.format(envId=envId, farmRoleId=farmRoleId)
-        farmRoles[farmRoleId] = client.fetch(path)
-
-    result = {'_meta' : 
-                {'hostvars': {}}
-             }
-    for farmId, farm in farms.iteritems():
-        result[farm['name']] = {'vars': {
-                                        'id': farmId,
-                                        'project': farm['project']['id'],
-                                        'owner': farm['owner']['id']
-                                    }, 
-                                'children': []}
-        for farmRoleId, farmRole in farmRoles.iteritems():
-            if farmRole['farm']['id'] != farmId:
-                continue
-            farmRoleGroupId = 'farm-role-' + str(farmRoleId) + '-' + farmRole['alias']
-            result[farm['name']]['children'].append(farmRoleGroupId)
-            result[farmRoleGroupId] = {'hosts': [], 'vars': {
-                                        'id': farmRoleId,
-                                        'platform': farmRole['cloudPlatform'],
-                                        'roleId': farmRole['role']['id']
-                                      }}
-            for server in servers:
-                if server['farmRole']['id'] != farmRoleId:
-                    continue
-                if len(server[IP_VARIABLE]) == 0:
-                    # Server has no public IP
-                    continue
-                result[farmRoleGroupId]['hosts'].append(server[IP_VARIABLE][0])
-                result['_meta']['hostvars'][server[IP_VARIABLE][0]] = base_variables(server)
-                if FETCH_GV:
-                    for gv in global_variables[server['id']]:
-                        if not gv['name'].startswith('SCALR_') and 'computedValue' in gv:
-                            result['_meta']['hostvars'][server[IP_VARIABLE][0]][gv['name']] = gv['computedValue']
-    print json.dumps(result, indent=2)
-
-def get_farm_servers(client, envId, farmId):
-    if '' in SERVER_STATUS:
-        servers_path = '/api/v1beta0/user/{envId}/farms/{farmId}/servers/'.format(envId=envId, farmId=farmId)
-        servers = client.list(servers_path)
-    else:
-        servers = list(itertools.chain.from_iterable([
-            client.list('/api/v1beta0/user/{envId}/farms/{farmId}/servers/?status={s}'.format(envId=envId, farmId=farmId, s=s))
-            for s in SERVER_STATUS
-        ]))
+    for fId in started_farms:
+        farmRoles.update({r['id']: r for r in client.list(farmRoles_path.format(envId=envId, farmId=fId))
+                          if farm_role_selected(filters, r)})
+    servers = [s for s in servers if s['farmRole']['id'] in farmRoles]
+    farms = {fId: f for fId, f in farms.items() if fId in set([s['farm']['id'] for s in servers])}
+    farmRoles = {rId: r for rId, r in farmRoles.items() if rId in set([s['farmRole']['id'] for s in servers])}
 
     global_variables = {}
     if FETCH_GV:
@@ -240,138 +272,291 @@ def get_farm_servers(client, envId, farmId):
             GV_path = '/api/v1beta0/user/{envId}/servers/{serverId}/global-variables/'.format(envId=envId, serverId=sId)
             global_variables[sId] = client.list(GV_path)
 
-    farmRoleIds = []
+    farmRecords = {}
     for s in servers:
-        farmRoleIds.append(s['farmRole']['id'])
-    farmRoleIds = set(farmRoleIds)
+        serverFarm = s['farm']['id']
+        serverFarmRole = s['farmRole']['id']
+        if not serverFarm in farmRecords:
+            farm = farms[serverFarm]
+            farmRecords[serverFarm] = {
+                'id': serverFarm,
+                'name': farm['name'],
+                'project': farm['project']['id'],
+                'owner': farm['owner']['id'],
+                'farmRoles': {}
+            }
+        farmRecord = farmRecords[serverFarm]
+        if not serverFarmRole in farmRecord['farmRoles']:
+            farmRole = farmRoles[serverFarmRole]
+            farmRecord['farmRoles'][serverFarmRole] = {
+                'id': serverFarmRole,
+                'alias': farmRole['alias'],
+                'cloudPlatform': farmRole['cloudPlatform'],
+                'roleId': farmRole['role']['id'],
+                'servers': []
+            }
+        farmRecord['farmRoles'][serverFarmRole]['servers'].append({
+            'ip': s[IP_VARIABLE][0],
+            'cloudLocation': s['cloudLocation'],
+            'hostvars': server_variables(s, global_variables)
+        })
 
-    farm_path = '/api/v1beta0/user/{envId}/farms/{farmId}/'.format(envId=envId, farmId=farmId)
-    farm = client.fetch(farm_path)
+    for farmRecord in farmRecords.values():
+        farmRecord['farmRoles'] = farmRecord['farmRoles'].values()
+    return farmRecords.values()
 
-    farmRoles = {}
-    farmRole_path = '/api/v1beta0/user/{envId}/farm-roles/{farmRoleId}/'
-    for farmRoleId in farmRoleIds:
-        path = farmRole_path.format(envId=envId, farmRoleId=farmRoleId)
-        farmRoles[farmRoleId] = client.fetch(path)
+def server_variables(server, global_variables):
+    variables = base_variables(server)
+    if FETCH_GV:
+        for gv in global_variables[server['id']]:
+            if not gv['name'].startswith('SCALR_') and 'computedValue' in gv:
+                variables[gv['name']] = gv['computedValue']
+    return variables
 
-    result = {'_meta' : 
-                {'hostvars': {}}
-             }
+def get_env_servers(client, envId, filters):
+    return get_farms(client, envId, filters)
 
-    for farmRoleId, farmRole in farmRoles.iteritems():
-        farmRoleGroupId = 'farm-role-' + str(farmRoleId) + '-' + farmRole['alias']
+def get_farm_servers(client, envId, farmId, filters):
+    return get_farms(client, envId, filters, farmId)
+
+def get_acct_servers(client, filters):
+    env_path = '/api/v1beta0/account/environments/'
+    envs = [e for e in client.list(env_path) if env_selected(filters, e)]
+    model = []
+    for e in envs:
+        model.append({
+            'id': e['id'],
+            'name': e['name'],
+            'status': e['status'],
+            'farms': get_farms(client, e['id'], filters)
+        })
+    return model
+
+def render_farm_role_groups(result, farm):
+    farmRoleGroups = []
+    for farmRole in farm['farmRoles']:
+        farmRoleGroupId = 'farm-role-' + str(farmRole['id']) + '-' + farmRole['alias']
         result[farmRoleGroupId] = {'hosts': [], 'vars': {
-                                    'id': farmRoleId,
+                                    'id': farmRole['id'],
                                     'platform': farmRole['cloudPlatform'],
-                                    'roleId': farmRole['role']['id']
+                                    'roleId': farmRole['roleId']
                                   }}
-        for server in servers:
-            if server['farmRole']['id'] != farmRoleId:
-                continue
-            if len(server[IP_VARIABLE]) == 0:
-                # Server has no public IP
-                continue
-            result[farmRoleGroupId]['hosts'].append(server[IP_VARIABLE][0])
-            result['_meta']['hostvars'][server[IP_VARIABLE][0]] = base_variables(server)
-            if FETCH_GV:
-                for gv in global_variables[server['id']]:
-                    if not gv['name'].startswith('SCALR_') and 'computedValue' in gv:
-                        result['_meta']['hostvars'][server[IP_VARIABLE][0]][gv['name']] = gv['computedValue']
-    print json.dumps(result, indent=2)
-
-def get_acct_servers(client):
-    env_path = '/api/v1beta0/account/environments/'
-    envs = client.list(env_path)
+        for server in farmRole['servers']:
+            result[farmRoleGroupId]['hosts'].append(server['ip'])
+            result['_meta']['hostvars'][server['ip']] = server['hostvars']
+        farmRoleGroups.append(farmRoleGroupId)
+    return farmRoleGroups
+
+def farm_group(farm, farmRoleGroups):
+    return {'vars': {
+                'id': farm['id'],
+                'project': farm['project'],
+                'owner': farm['owner']
+            },
+            'children': farmRoleGroups}
+
+def render_farm_inventory(farms):
     result = {'_meta' : 
                 {'hostvars': {}}
              }
-    for e in envs:
-        envId = e['id']
+    for farm in farms:
+        render_farm_role_groups(result, farm)
+    return result
 
-        if '' in SERVER_STATUS:
-            servers_path = '/api/v1beta0/user/{envId}/servers/'.format(envId=envId)
-            servers = client.list(servers_path)
-        else:
-            servers = list(itertools.chain.from_iterable([
-                client.list('/api/v1beta0/user/{envId}/servers/?status={s}'.format(envId=envId, s=s))
-                for s in SERVER_STATUS
-            ]))
-
-        global_variables = {}
-        if FETCH_GV:
-            for server in servers:
-                sId = server['id']
-                GV_path = '/api/v1beta0/user/{envId}/servers/{serverId}/global-variables/'.format(envId=envId, serverId=sId)
-                global_variables[sId] = client.list(GV_path)
-
-        farms_path = '/api/v1beta0/user/{envId}/farms/'.format(envId=envId)
-        farms = client.list(farms_path)
-
-        started_farms = set([s['farm']['id'] for s in servers])
-        farms = {f['id']: f for f in farms if f['id'] in started_farms}
-
-        farmRoles_path = '/api/v1beta0/user/{envId}/farms/{farmId}/farm-roles/'
-        farmRoles = {}
-        for farmId in started_farms:
-            farmRoles.update({f['id']: f for f in client.list(farmRoles_path.format(envId=envId, farmId=farmId))})
+def render_env_inventory(farms):
+    result = {'_meta' : 
+                {'hostvars': {}}
+             }
+    for farm in farms:
+        result[farm['name']] = farm_group(farm, render_farm_role_groups(result, farm))
+    return result
 
-        envGroups = {}
-        for s in servers:
-            if len(s[IP_VARIABLE]) == 0:
-                # Can't find an IP
-                continue
-            serverFarm = s['farm']['id']
-            serverFarmRole = s['farmRole']['id']
-            if not serverFarm in envGroups:
-                farm = farms[serverFarm]
-                envGroups[serverFarm] =  {'vars': {
-                                            'id': serverFarm,
-                                            'project': farm['project']['id'],
-                                            'owner': farm['owner']['id']
-                                        }, 
-                                        'children': {}}
-            farmGroup = envGroups[serverFarm]
-            if not serverFarmRole in farmGroup['children']:
-                farmRole = farmRoles[serverFarmRole]
-                farmGroup['children'][serverFarmRole] = {'hosts': [], 'vars': {
-                                                        'id': serverFarmRole,
-                                                        'platform': farmRole['cloudPlatform'],
-                                                        'roleId': farmRole['role']['id']
-                                                      }}
-            farmRoleGroup = farmGroup['children'][serverFarmRole]
-            farmRoleGroup['hosts'].append(s[IP_VARIABLE][0])
-            result['_meta']['hostvars'][s[IP_VARIABLE][0]] = base_variables(s)
-            if FETCH_GV:
-                for gv in global_variables[s['id']]:
-                    if not gv['name'].startswith('SCALR_') and 'computedValue' in gv:
-                        result['_meta']['hostvars'][s[IP_VARIABLE][0]][gv['name']] = gv['computedValue']
-
-        # Unpacking, 1: farm roles
-        for farmId, farmGroup in envGroups.items():
-            farmRoleGroups = []
-            for farmRoleId, farmRoleGroup in farmGroup['children'].items():
-                farmRoleGroupId = 'farm-role-' + str(farmRoleId) + '-' + farmRoles[farmRoleId]['alias']
-                result[farmRoleGroupId] = farmRoleGroup
-                farmRoleGroups.append(farmRoleGroupId)
-            farmGroup['children'] = farmRoleGroups
-
-        # Unpacking, 2: farms
+def render_inventory(model):
+    result = {'_meta' : 
+                {'hostvars': {}}
+             }
+    for env in model:
         farmGroups = []
-        for farmId, farmGroup in envGroups.items():
-            farmGroupId = 'farm-' + str(farmId) + '-' + farms[farmId]['name']
-            result[farmGroupId] = farmGroup
+        for farm in env['farms']:
+            farmGroupId = 'farm-' + str(farm['id']) + '-' + farm['name']
+            result[farmGroupId] = farm_group(farm, render_farm_role_groups(result, farm))
             farmGroups.append(farmGroupId)
 
         envRepr = {
             'vars': {
-                'status': e['status']
+                'status': env['status']
             },
             'children': farmGroups
         }
-        result['Env ' + str(envId) + ': ' + e['name']] = envRepr
+        result['Env ' + str(env['id']) + ': ' + env['name']] = envRepr
+    return result
+
+def select_model(model, filters):
+    """
+    Apply the farm role, platform and location filters to a loaded model.
+    """
+    for env in model:
+        for farm in env['farms']:
+            for farmRole in farm['farmRoles']:
+                farmRole['servers'] = [s for s in farmRole['servers'] if server_selected(filters, s)]
+            farm['farmRoles'] = [r for r in farm['farmRoles']
+                                 if r['servers'] and farm_role_selected(filters, r)]
+        env['farms'] = [f for f in env['farms'] if f['farmRoles']]
+    return model
+
+def write_snapshot(path, model):
+    index = {'envs': []}
+    hosts = {}
+    blocks = []
+    offset = 0
+    for env in model:
+        envEntry = {'id': env['id'], 'name': env['name'], 'status': env['status'], 'farms': []}
+        for farm in env['farms']:
+            block = zlib.compress(json.dumps(farm, separators=(',', ':')))
+            envEntry['farms'].append({'id': farm['id'], 'name': farm['name'],
+                                      'offset': offset, 'length': len(block)})
+            for farmRole in farm['farmRoles']:
+                for server in farmRole['servers']:
+                    host = server['ip'].encode('utf-8')
+                    if len(host) > SNAPSHOT_HOST_LENGTH:
+                        raise ValueError("Host {0} is too long for a snapshot".format(server['ip']))
+                    hosts[host] = (offset, len(block))
+            blocks.append(block)
+            offset += len(block)
+        index['envs'].append(envEntry)
+
+    indexBlock = zlib.compress(json.dumps(index, separators=(',', ':')))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack(SNAPSHOT_HEADER, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(hosts), len(indexBlock)))
+        for host in sorted(hosts):
+            f.write(struct.pack(SNAPSHOT_HOST, host, *hosts[host]))
+        f.write(indexBlock)
+        for block in blocks:
+            f.write(block)
+    os.rename(tmp_path, path)
+
+
+class ScalrSnapshot(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                raise ValueError("Not a Scalr inventory snapshot: {0}".format(path))
+        try:
+            headerSize = struct.calcsize(SNAPSHOT_HEADER)
+            if len(self.data) < headerSize:
+                raise ValueError("Not a Scalr inventory snapshot: {0}".format(path))
+            magic, version, hostCount, indexLength = struct.unpack_from(SNAPSHOT_HEADER, self.data, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError("Not a Scalr inventory snapshot: {0}".format(path))
+            if version != SNAPSHOT_VERSION:
+                raise ValueError("Unsupported snapshot version {0} in {1}".format(version, path))
+            self.hosts_offset = headerSize
+            self.host_count = hostCount
+            indexOffset = headerSize + hostCount * struct.calcsize(SNAPSHOT_HOST)
+            self.blocks_offset = indexOffset + indexLength
+            self.index = self.decode(indexOffset, indexLength)
+        except ValueError:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
-    print json.dumps(result, indent=2)
+    def close(self):
+        self.data.close()
 
+    def decode(self, start, length):
+        if start < 0 or length < 0 or start + length > len(self.data):
+            raise ValueError("Not a Scalr inventory snapshot: {0}".format(self.path))
+        try:
+            return json.loads(zlib.decompress(self.data[start:start + length]))
+        except (zlib.error, ValueError):
+            raise ValueError("Not a Scalr inventory snapshot: {0}".format(self.path))
+
+    def read_block(self, offset, length):
+        return self.decode(self.blocks_offset + offset, length)
+
+    def model(self, filters, env_id=None, farm_id=None):
+        """
+        Load the environments and farms selected by the filters (and optionally
+        scoped to a single environment, or a single farm in that environment,
+        as in main). Other farm blocks are not read.
+        """
+        model = []
+        for envEntry in self.index['envs']:
+            if env_id:
+                if str(envEntry['id']) != str(env_id):
+                    continue
+            elif not env_selected(filters, envEntry):
+                continue
+            farms = []
+            for farmEntry in envEntry['farms']:
+                if env_id and farm_id and str(farmEntry['id']) != str(farm_id):
+                    continue
+                if not farm_selected(filters, farmEntry):
+                    continue
+                farms.append(self.read_block(farmEntry['offset'], farmEntry['length']))
+            model.append({
+                'id': envEntry['id'],
+                'name': envEntry['name'],
+                'status': envEntry['status'],
+                'farms': farms
+            })
+        return select_model(model, filters)
+
+    def find_host(self, host):
+        """
+        Binary-search the host table for the farm block of a host.
+        """
+        # Entries are null-padded, which keeps them in the same order
+        key = struct.pack('>{0}s'.format(SNAPSHOT_HOST_LENGTH), host.encode('utf-8'))
+        entrySize = struct.calcsize(SNAPSHOT_HOST)
+        low, high = 0, self.host_count
+        while low < high:
+            middle = (low + high) // 2
+            name, offset, length = struct.unpack_from(SNAPSHOT_HOST, self.data, self.hosts_offset + middle * entrySize)
+            if name < key:
+                low = middle + 1
+            elif name > key:
+                high = middle
+            else:
+                return offset, length
+        return None
+
+    def hostvars(self, host):
+        entry = self.find_host(host)
+        if entry is None:
+            return {}
+        farm = self.read_block(*entry)
+        for farmRole in farm['farmRoles']:
+            for server in farmRole['servers']:
+                if server['ip'] == host:
+                    return server['hostvars']
+        return {}
+
+
+def read_snapshot(path, query):
+    """
+    Run query on the snapshot at path. Reports an unreadable snapshot and
+    returns None.
+    """
+    if not os.path.isfile(path):
+        print 'Snapshot not found: {0}, exiting.'.format(path)
+        return None
+    try:
+        with ScalrSnapshot(path) as snapshot:
+            return query(snapshot)
+    except ValueError as e:
+        print '{0}, exiting.'.format(e)
+        return None
 
 def main():
     api_url = os.environ.get('SCALR_API_URL')
@@ -379,6 +564,27 @@ def main():
     api_key_secret = os.environ.get('SCALR_API_KEY_SECRET')
     env_id = os.environ.get('SCALR_ENV_ID')
     farm_id = os.environ.get('SCALR_FARM_ID')
+    snapshot_path = os.environ.get('SCALR_SNAPSHOT')
+    snapshot_export = os.environ.get('SCALR_SNAPSHOT_EXPORT')
+
+    if snapshot_path:
+        if snapshot_export:
+            print 'Snapshot export can\'t be combined with SCALR_SNAPSHOT, exiting.'
+            return
+        model = read_snapshot(snapshot_path, lambda snapshot: snapshot.model(get_filters(), env_id, farm_id))
+        if model is None:
+            return
+        farms = list(itertools.chain.from_iterable([env['farms'] for env in model]))
+        if env_id and farm_id:
+            print json.dumps(render_farm_inventory(farms), indent=2)
+        elif env_id:
+            print json.dumps(render_env_inventory(farms), indent=2)
+        else:
+            print json.dumps(render_inventory(model), indent=2)
+        return
+    if snapshot_export and env_id:
+        print 'Snapshot export is only supported for the whole account (unset SCALR_ENV_ID), exiting.'
+        return
 
     if not api_url:
         print 'API URL not specified, exiting.'
@@ -393,15 +599,24 @@ def main():
     client = ScalrApiClient(api_url.rstrip("/"), api_key_id, api_key_secret)
     if env_id:
         if farm_id:
-            get_farm_servers(client, env_id, farm_id)
+            farms = get_farm_servers(client, env_id, farm_id, get_filters())
+            print json.dumps(render_farm_inventory(farms), indent=2)
         else:
-            get_env_servers(client, env_id)
+            farms = get_env_servers(client, env_id, get_filters())
+            print json.dumps(render_env_inventory(farms), indent=2)
     else:
-        get_acct_servers(client)
+        model = get_acct_servers(client, get_filters())
+        if snapshot_export:
+            write_snapshot(snapshot_export, model)
+        print json.dumps(render_inventory(model), indent=2)
 
 if __name__ == "__main__":
     if len(sys.argv) >= 2 and sys.argv[1] == '--list':
         main()
+    elif len(sys.argv) >= 3 and sys.argv[1] == '--host' and os.environ.get('SCALR_SNAPSHOT'):
+        hostvars = read_snapshot(os.environ['SCALR_SNAPSHOT'], lambda snapshot: snapshot.hostvars(sys.argv[2]))
+        if hostvars is not None:
+            print json.dumps(hostvars, indent=2)
     else:
         print '{}'
 